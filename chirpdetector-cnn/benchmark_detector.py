@@ -21,6 +21,22 @@ ps = PlotStyle()
 pretty.install()
 
 
+def nearest_distances(targets, reference):
+    """
+    Compute the distance of each target to the closest value in the
+    reference by a binary search on the sorted reference, which avoids
+    building the full matrix of pairwise distances.
+    """
+    if len(reference) == 0:
+        return np.full(len(targets), np.inf)
+
+    reference = np.sort(reference)
+    idx = np.searchsorted(reference, targets)
+    left = reference[np.clip(idx - 1, 0, len(reference) - 1)]
+    right = reference[np.clip(idx, 0, len(reference) - 1)]
+    return np.minimum(np.abs(targets - left), np.abs(targets - right))
+
+
 def benchmark():
     path = Path(conf.testing_data_path)
     modelpath = conf.save_dir
@@ -44,17 +60,14 @@ def benchmark():
         ]
         detected_chirps = chirp_times[chirp_idents == fish_id]
 
-        # check for false negatives
-        fn_counter = 0
-        for rc in real_chirps:
-            if not any(np.abs(rc - detected_chirps) < tolerance):
-                fn_counter += 1
-
-        # check for false positives
-        fp_counter = 0
-        for dc in detected_chirps:
-            if not any(np.abs(dc - real_chirps) < tolerance):
-                fp_counter += 1
+        # false negatives are real chirps without a detection and
+        # false positives are detections without a real chirp
+        fn_counter = int(
+            np.sum(nearest_distances(real_chirps, detected_chirps) >= tolerance)
+        )
+        fp_counter = int(
+            np.sum(nearest_distances(detected_chirps, real_chirps) >= tolerance)
+        )
 
         # compute precision, recall, accuracy, error
         precs.append(len(real_chirps) / (len(real_chirps) + fp_counter))
@@ -7,8 +7,11 @@ to slide the detector across the tracks of a single fish.
 """
 
 import argparse
+import importlib.util
 import pathlib
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import matplotlib
 
@@ -17,15 +20,23 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 import torch.nn.functional as F
-from IPython import embed
 from models.audioclassifier import AudioClassifier
-from models.modelhandling import check_device, load_model
+from models.modelhandling import (
+    OnnxModel,
+    SpectrogramDataset,
+    check_device,
+    export_onnx,
+    load_model,
+    quantize_model,
+)
 from rich import pretty, print
 from rich.progress import track
 from scipy.interpolate import interp1d
+from torch.utils.data import DataLoader, Dataset, get_worker_info
 from utils.datahandling import (
     cluster_peaks,
-    find_on_time,
+    extract_snippets,
+    find_on_times,
     merge_duplicates,
     resize_tensor_image,
 )
@@ -46,6 +57,8 @@ logger = make_logger(__name__)
 conf = ConfLoader("config.yml")
 device = check_device()
 model = AudioClassifier
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
 ps = PlotStyle()
 pretty.install()
 
@@ -126,18 +139,14 @@ def interpolate(data):
     index_helper = np.arange(len(new_times))
     ids = np.unique(data.track_idents[~np.isnan(data.track_idents)])
     for track_id in ids:
-        start_time = data.track_times[
-            data.track_indices[data.track_idents == track_id][0]
-        ]
-        stop_time = data.track_times[
-            data.track_indices[data.track_idents == track_id][-1]
-        ]
-        times_full = new_times[(new_times >= start_time) & (new_times <= stop_time)]
-        times_sampled = data.track_times[
-            data.track_indices[data.track_idents == track_id]
-        ]
+        track_mask = data.track_idents == track_id
+        times_sampled = data.track_times[data.track_indices[track_mask]]
+        start_time = times_sampled[0]
+        stop_time = times_sampled[-1]
+        time_mask = (new_times >= start_time) & (new_times <= stop_time)
+        times_full = new_times[time_mask]
         times_sampled = np.append(times_sampled, times_sampled[-1])
-        freqs_sampled = data.track_freqs[data.track_idents == track_id]
+        freqs_sampled = data.track_freqs[track_mask]
         freqs_sampled = np.append(freqs_sampled, freqs_sampled[-1])
 
         # remove duplocates on the time array
@@ -149,7 +158,7 @@ def interpolate(data):
         f = interp1d(times_sampled, freqs_sampled, kind="cubic")
         freqs_interp = f(times_full)
 
-        index_interp = index_helper[(new_times >= start_time) & (new_times <= stop_time)]
+        index_interp = index_helper[time_mask]
         ident_interp = np.ones(len(freqs_interp)) * track_id
 
         track_idents.append(ident_interp)
@@ -167,24 +176,50 @@ def interpolate(data):
     return data
 
 
-def classify(model, img):
+def classify(model, imgs, pad_to=None):
     """
-    Classify a spectrogram image
+    Classify a batch of spectrogram images in a single forward pass.
+    If pad_to is given, smaller batches are zero-padded to that size so
+    that the model always sees the same input shape, the padded outputs
+    are dropped.
     """
-    with torch.no_grad():
-        outputs = model(img)
+    param = next(model.parameters(), None)
+    dtype = param.dtype if param is not None else torch.float32
+    n_imgs = len(imgs)
+    if (pad_to is not None) and (n_imgs < pad_to):
+        imgs = F.pad(imgs, (0, 0, 0, 0, 0, 0, 0, pad_to - n_imgs))
+    with torch.inference_mode():
+        outputs = model(imgs.to(dtype))[:n_imgs].float()
         probs = F.softmax(outputs, dim=1)
-        _, preds = torch.max(outputs, dim=1)
-    probs = probs.cpu().numpy()[0][0]
-    preds = preds.cpu().numpy()[0]
+        preds = torch.argmax(outputs, dim=1)
+    probs = probs.cpu().numpy()
+    preds = preds.cpu().numpy()
     return probs, preds
 
 
-def detect_chirps(
+def warmup(model, img_size, n_iter=2):
+    """
+    Run dummy batches through the model so that cudnn can benchmark and
+    cache the fastest convolution algorithms before the detection starts.
+    """
+    param = next(model.parameters())
+    dummy = torch.rand(
+        conf.detection_batch_size,
+        1,
+        img_size,
+        img_size,
+        device=param.device,
+        dtype=param.dtype,
+    )
+    with torch.inference_mode():
+        for _ in range(n_iter):
+            model(dummy)
+
+
+def detect_track_chirps(
+    track_id,
     model,
     stride,
-    window_size,
-    outer_iter,
     spec,
     spec_freqs,
     spec_times,
@@ -192,172 +227,193 @@ def detect_chirps(
     track_times,
     track_indices,
     track_idents,
+    window_ranges,
+    window_center_times,
+    pad_range,
+    pad_to=None,
 ):
-    window_starts = np.arange(0, len(spec_times) - window_size, stride, dtype=int)
-    detect_chirps = []
-    iter = 0
+    """
+    Slide the detector along a single frequency track and return the
+    detected chirps as rows of (time, frequency, probability, track id).
+    """
+    logger.info(f"Detecting chirps for track {track_id}")
+    track_mask = track_idents == track_id
+    track = track_freqs[track_mask]
+    time = track_times[track_indices[track_mask]]
 
-    # make blacklisted areas where vertical noise bands are too strong
-    threshold = spec.std().cpu().numpy()
-    noise_subset = spec[spec_freqs < 300]
-    noise_profile = torch.mean(noise_subset, axis=0)
-    noise_profile = noise_profile.cpu().numpy()
-    noise_index = np.zeros_like(noise_profile, dtype=bool)
-    # noise_index[noise_profile > threshold] = True
+    # check if the track has data in this window
+    if time[0] > spec_times[-1]:
+        return np.empty((0, 4))
 
-    for track_id in np.unique(track_idents):
-        logger.info(f"Detecting chirps for track {track_id}")
-        track = track_freqs[track_idents == track_id]
-        time = track_times[track_indices[track_idents == track_id]]
+    # make blacklisted areas where low amplitude is too low below
+    # the frequency track
 
-        # check if the track has data in this window
-        if time[0] > spec_times[-1]:
-            continue
+    # pred_labels = []
+    # pred_probs = []
+    # center_times = []
+    # center_freqs = []
 
-        # make blacklisted areas where low amplitude is too low below
-        # the frequency track
+    # Find the center time from the spec on the frequency track
+    window_center_track = find_on_times(time, window_center_times, True)
 
-        # pred_labels = []
-        # pred_probs = []
-        # center_times = []
-        # center_freqs = []
+    # If the frequency track has not data, remove the windows so that
+    # the classification is not run on them
+    has_data = ~np.isnan(window_center_track)
+    center_times = window_center_times[has_data]
+    time_ranges = window_ranges[has_data]
+    window_center_track = window_center_track[has_data].astype(int)
 
-        # Find the time starts and stops of the windows on the spectrogram
-        window_ranges = window_starts[:, np.newaxis] + np.arange(window_size)
-        center_time_indices = window_ranges[:, int(window_size / 2)]
-        center_times = spec_times[center_time_indices]
+    if len(window_center_track) == 0:
+        logger.info("No data in this window, skipping")
+        return np.empty((0, 4))
 
-        # Find the center time from the spec on the frequency track
-        window_center_track = np.asarray(
-            [find_on_time(time, t, True) for t in center_times]
-        )
+    if len(center_times) == 0:
+        logger.info("No data in this window, skipping")
+        return np.empty((0, 4))
 
-        # If the frequency track has not data, remove the windows so that
-        # the classification is not run on them
-        center_times = center_times[~np.isnan(window_center_track)]
-        time_ranges = window_ranges[~np.isnan(window_center_track)]
-        window_center_track = window_center_track[~np.isnan(window_center_track)].astype(
-            int
-        )
+    # Get the frequencies from the track corresponding to the times
+    # on the track
+    window_center_freq = track[window_center_track]
 
-        if len(window_center_track) == 0:
-            logger.info("No data in this window, skipping")
-            continue
+    # get the frequencies from the spectrogram corresponding to the
+    # frequencies on the track
+    window_center_freq_index = get_closest_indices(spec_freqs, window_center_freq)
 
-        if len(center_times) == 0:
-            logger.info("No data in this window, skipping")
-            continue
+    center_freqs = spec_freqs[window_center_freq_index]
 
-        # Get the frequencies from the track corresponding to the times
-        # on the track
-        window_center_freq = track[window_center_track]
+    # add the padding indices to the indices of the center frequencies
+    freq_ranges = window_center_freq_index[:, np.newaxis] + pad_range
 
-        # get the frequencies from the spectrogram corresponding to the
-        # frequencies on the track
-        window_center_freq_index = get_closest_indices(spec_freqs, window_center_freq)
+    # process the windows in batches to bound the memory footprint on the
+    # device, only one batch of snippets exists at a time
+    pred_probs = np.empty(len(freq_ranges))
+    for start in range(0, len(freq_ranges), conf.detection_batch_size):
+        batch = slice(start, start + conf.detection_batch_size)
 
-        center_freqs = spec_freqs[window_center_freq_index]
+        # cut out the 2d areas bounded by the time and frequency ranges
+        # from the spectrogram tensor in a single gather on the device
+        snippets = extract_snippets(spec, freq_ranges[batch], time_ranges[batch])
 
-        # convert the frequency padding from the conf to indices on the spec_freqs
-        pads = conf.freq_pad[0], conf.freq_pad[1]
-        pad_indices = get_closest_indices(spec_freqs, pads)
+        # interpolate, this step will be removed in the future
+        snippets = resize_tensor_image(snippets, conf.img_size_px)
 
-        # add the indices to the indices of the center frequencies
-        freq_ranges = window_center_freq_index[:, np.newaxis] + np.arange(
-            -pad_indices[0], pad_indices[1]
-        )
+        # do nessesary transformations to the snippets before classification
+        snippets = snippets.to(torch.float32)
 
-        # index helpers
-        n_windows = len(center_times)
-        n_freqs = len(spec_freqs)
-        n_freq_subset = len(freq_ranges[0])
-        n_times = len(time_ranges[0])
+        # classify the snippets
+        probs, _ = classify(model, snippets, pad_to=pad_to)
+        pred_probs[batch] = 1 - probs[:, 0]
 
-        # cut out the 2d areas from the spectrogram tensor bounded by the
-        # time and frequency ranges
-        time_tensor = spec[:, time_ranges].permute(1, 0, 2)
+    # lowpass filter the probabilities
+    fs = 1 / stride
+    pred_probs = lowpass_filter(pred_probs, fs, fs / 10)
 
-        # make a mask of the same shape as the spectrogram tensor
-        mask = np.zeros((n_windows, n_freqs, n_times), dtype=bool)
-        mask[np.arange(n_windows)[:, None, None], freq_ranges[:, :, None], :] = True
+    # normalize to 0 and 1 again (lowpass adds artefacts)
+    # pred_probs = (pred_probs - np.min(pred_probs)) / (
+    #     pred_probs.max() - pred_probs.min()
+    # )
 
-        # convert the mask to a tensor
-        mask = torch.tensor(mask).to(device)
+    # get chirp clusters from the predictions
+    cluster_indices = cluster_peaks(pred_probs, conf.min_chirp_prob)
 
-        # apply the mask to extract the desired frequencies for each window
-        snippets = time_tensor[mask].view(n_windows, n_freq_subset, n_times)
+    # compute the weighted average of the center times and frequencies
+    # This is the first chirp sorting step!
+    # Each row is a chirp of (time, frequency, probability, track id)
+    current_chirps = np.empty((len(cluster_indices), 4))
+    current_chirps[:, 3] = track_id
+    for i, cluster in enumerate(cluster_indices):
+        probs = pred_probs[cluster]
+        times = center_times[cluster]
+        freqs = center_freqs[cluster]
+        current_chirps[i, 0] = np.average(times, weights=probs)
+        current_chirps[i, 1] = np.average(freqs, weights=probs)
+        current_chirps[i, 2] = np.max(probs)
 
-        # add channel dimension size image data is expected and classically has
-        # channels
-        snippets = snippets[:, None, :, :]
+    # logger.info("Removing chirps that are in low power areas ...")
 
-        # interpolate, this step will be removed in the future
-        snippets = F.interpolate(snippets, size=(128, 128), mode="area")
+    logger.info(f"Found {len(current_chirps)} chirps")
 
-        # do nessesary transformations to the snippets before classification
-        snippets = snippets.to(torch.float32)
+    return current_chirps
 
-        # classify the snippets
-        with torch.no_grad():
-            outputs = model(snippets)
-            probs = F.softmax(outputs, dim=1)
-            _, preds = torch.max(outputs, dim=1)
-
-        # convert the outputs to numpy arrays
-        pred_probs = 1 - probs.cpu().numpy()[:, 0]
-        pred_labels = preds.cpu().numpy()
-
-        # lowpass filter the probabilities
-        fs = 1 / stride
-        pred_probs = lowpass_filter(pred_probs, fs, fs / 10)
-
-        # normalize to 0 and 1 again (lowpass adds artefacts)
-        # pred_probs = (pred_probs - np.min(pred_probs)) / (
-        #     pred_probs.max() - pred_probs.min()
-        # )
-
-        # get chirp clusters from the predictions
-        cluster_indices = cluster_peaks(pred_probs, conf.min_chirp_prob)
-
-        # compute the weighted average of the center times and frequencies
-        # This is the first chirp sorting step!
-        weighted_times = []
-        weighted_freqs = []
-        max_probs = []
-        for cluster in cluster_indices:
-            probs = pred_probs[cluster]
-            times = center_times[cluster]
-            freqs = center_freqs[cluster]
-            weighted_freqs.append(np.average(freqs, weights=probs))
-            weighted_times.append(np.average(times, weights=probs))
-            max_probs.append(np.max(probs))
-
-        # convert to numpy arrays
-        weighted_times = np.asarray(weighted_times)
-        weighted_freqs = np.asarray(weighted_freqs)
-        max_probs = np.asarray(max_probs)
-        chirp_id = np.repeat(track_id, len(weighted_times))
-
-        # logger.info("Removing chirps that are in low power areas ...")
-
-        logger.info(f"Found {len(weighted_times)} chirps")
-
-        # put into touples for comparison across tracks
-        current_chirps = list(zip(weighted_times, weighted_freqs, max_probs, chirp_id))
-
-        # append to the list of chirps
-        detect_chirps.extend(current_chirps)
 
-    logger.info("Sorting chirps...")
+def detect_chirps(
+    model,
+    stride,
+    window_size,
+    outer_iter,
+    spec,
+    spec_freqs,
+    spec_times,
+    track_freqs,
+    track_times,
+    track_indices,
+    track_idents,
+    pad_to=None,
+):
+    window_starts = np.arange(0, len(spec_times) - window_size, stride, dtype=int)
 
-    # sort the chirps by time
-    detected_chirps = np.asarray(detect_chirps)
+    # make blacklisted areas where vertical noise bands are too strong
+    threshold = spec.std().cpu().numpy()
+    noise_subset = spec[spec_freqs < 300]
+    noise_profile = torch.mean(noise_subset, axis=0)
+    noise_profile = noise_profile.cpu().numpy()
+    noise_index = np.zeros_like(noise_profile, dtype=bool)
+    # noise_index[noise_profile > threshold] = True
+
+    # Find the time starts and stops of the windows on the spectrogram,
+    # these are the same for all tracks
+    window_ranges = window_starts[:, np.newaxis] + np.arange(window_size)
+    center_time_indices = window_ranges[:, int(window_size / 2)]
+    window_center_times = spec_times[center_time_indices]
+
+    # convert the frequency padding from the conf to indices on the spec_freqs
+    pads = conf.freq_pad[0], conf.freq_pad[1]
+    pad_indices = get_closest_indices(spec_freqs, pads)
+    pad_range = np.arange(-pad_indices[0], pad_indices[1])
+
+    # the tracks only share read-only data, so on the cpu they are processed
+    # in parallel threads while torch releases the gil in its kernels
+    detect_track = partial(
+        detect_track_chirps,
+        model=model,
+        stride=stride,
+        spec=spec,
+        spec_freqs=spec_freqs,
+        spec_times=spec_times,
+        track_freqs=track_freqs,
+        track_times=track_times,
+        track_indices=track_indices,
+        track_idents=track_idents,
+        window_ranges=window_ranges,
+        window_center_times=window_center_times,
+        pad_range=pad_range,
+        pad_to=pad_to,
+    )
+    track_ids = np.unique(track_idents)
+    if (spec.device.type == "cpu") and (conf.track_workers > 1):
+        # split the intra-op threads of torch between the workers so that
+        # the pool does not oversubscribe the cpu
+        n_threads = torch.get_num_threads()
+        torch.set_num_threads(max(1, n_threads // conf.track_workers))
+        try:
+            with ThreadPoolExecutor(max_workers=conf.track_workers) as executor:
+                track_chirps = list(executor.map(detect_track, track_ids))
+        finally:
+            torch.set_num_threads(n_threads)
+    else:
+        track_chirps = [detect_track(track_id) for track_id in track_ids]
+
+    # join the chirps of all tracks into a single array
+    detected_chirps = np.concatenate([np.empty((0, 4)), *track_chirps])
+
+    logger.info("Sorting chirps...")
 
     # if there are no chirps, return an empty list
-    if len(detect_chirps) == 0:
+    if len(detected_chirps) == 0:
         return [], noise_index
     # [], []
 
+    # sort the chirps by time
     detected_chirps = detected_chirps[detected_chirps[:, 0].argsort()]
 
     # now group all chirps that are close in time and frequency
@@ -376,6 +432,65 @@ def detect_chirps(
     return chirps, noise_index
 
 
+class ChunkDataset(Dataset):
+    """
+    Split a recording into overlapping chunks. Chunks before the first track
+    or without track data are returned as None.
+    """
+
+    def __init__(self, data, chunksize, overlap):
+        self.data = data
+        self.chunksize = chunksize
+        self.overlap = overlap
+        self.n_chunks = np.ceil(self.data.raw.shape[0] / self.chunksize).astype(int)
+
+    def __len__(self):
+        return self.n_chunks
+
+    def __getitem__(self, i):
+        # get start and stop indices for the current chunk
+        # including some overlap to compensate for edge effects
+        # this diffrers for the first and last chunk
+
+        if i == 0:
+            idx1 = sint(i * self.chunksize)
+            idx2 = sint((i + 1) * self.chunksize + self.overlap)
+        elif i == self.n_chunks - 1:
+            idx1 = sint(i * self.chunksize - self.overlap)
+            idx2 = sint((i + 1) * self.chunksize)
+        else:
+            idx1 = sint(i * self.chunksize - self.overlap)
+            idx2 = sint((i + 1) * self.chunksize + self.overlap)
+
+        # skip if the chunk is before the first track
+        first_chunk_time = idx1 / conf.samplerate
+        first_track_time = self.data.track_times[0]
+        if first_chunk_time < first_track_time:
+            return idx1, idx2, None
+
+        chunk = DataSubset(self.data, idx1, idx2)
+
+        # check if the chunk has data
+        if chunk.hasdata is False:
+            logger.info("No data in chunk, skipping...")
+            return idx1, idx2, None
+
+        # read the raw signal into an electrode-major tensor, tensors are
+        # passed from the loader workers through shared memory instead of
+        # being pickled through the pipe
+        chunk.raw = torch.from_numpy(np.ascontiguousarray(chunk.raw.T))
+
+        return idx1, idx2, chunk
+
+
+def reopen_worker_dataset(worker_id):
+    """
+    Give each loader worker its own handle on the raw recording. With the
+    spawn start method the worker's dataset arrives without it.
+    """
+    get_worker_info().dataset.data.reopen()
+
+
 class Detector:
     def __init__(self, modelpath, dataset):
         logger.info("Initializing detector...")
@@ -405,6 +520,12 @@ class Detector:
         # to compensate for edge effects
         self.spectrogram_overlap = conf.spectrogram_overlap * conf.samplerate
 
+        # reused buffers to copy the signals of the electrodes to the gpu,
+        # they are created with the first chunk
+        self.host_buffer = None
+        self.device_buffer = None
+        self.copy_done = None
+
         # load the dataset
         self.data = dataset
         self.n_electrodes = self.data.n_electrodes
@@ -422,67 +543,152 @@ class Detector:
             np.max(self.data.track_freqs) + 100,
         )
 
+        # load the model and either run it through onnxruntime, cast it
+        # to half precision on the gpu or quantize it to int8 on the cpu
+        # short batches are only padded to the full batch size where a new
+        # input shape is costly, i.e. for cudnn benchmark mode on the gpu and
+        # for the fixed input shape of the TensorRT engine
+        classifier = load_model(modelpath, model)
+        pad_to = None
+        if conf.use_onnx:
+            classifier = self.load_onnx(classifier, modelpath)
+        if isinstance(classifier, torch.nn.Module):
+            if next(classifier.parameters()).is_cuda:
+                if conf.detection_fp16:
+                    classifier = classifier.half()
+                warmup(classifier, conf.img_size_px)
+                pad_to = conf.detection_batch_size
+            elif conf.quantize_cpu:
+                classifier = self.quantize(classifier)
+        elif classifier.uses_tensorrt:
+            pad_to = conf.detection_batch_size
+
         self.detection_parameters = {
-            "model": load_model(modelpath, model),
+            "model": classifier,
+            "pad_to": pad_to,
             "stride": stride,
             "window_size": window_size,
         }
 
+    def stage_signal(self, sig):
+        """
+        Copy the signal tensor of an electrode to the gpu through a pinned
+        host buffer and a device buffer that are reused for all electrodes
+        and chunks. On the cpu, the signal is returned as is.
+        """
+        if not torch.cuda.is_available():
+            return sig
+
+        if self.host_buffer is None:
+            size = sint(self.chunksize + 2 * self.spectrogram_overlap)
+            dtype = sig.dtype
+            self.host_buffer = torch.empty(size, dtype=dtype, pin_memory=True)
+            self.device_buffer = torch.empty(size, dtype=dtype, device="cuda")
+            self.copy_done = torch.cuda.Event()
+
+        # the previous copy must have left the host buffer before it is
+        # overwritten, the device buffer is protected by stream order
+        self.copy_done.synchronize()
+        n = len(sig)
+        self.host_buffer[:n].copy_(sig)
+        self.device_buffer[:n].copy_(self.host_buffer[:n], non_blocking=True)
+        self.copy_done.record()
+        return self.device_buffer[:n]
+
+    def quantize(self, classifier):
+        """
+        Quantize the model to int8 for inference on the cpu, calibrated on
+        the training data. Falls back to the float model if there is no
+        training data to calibrate on.
+        """
+        trainpath = pathlib.Path(conf.training_data_path)
+        dataset = SpectrogramDataset(trainpath) if trainpath.is_dir() else []
+        if len(dataset) == 0:
+            logger.warning(
+                f"No training data in {trainpath} to calibrate the int8 model, using float model"
+            )
+            return classifier
+        # seed the shuffle so that the calibration and with it the
+        # quantized model are reproducible
+        generator = torch.Generator().manual_seed(conf.random_seed)
+        calibration_dl = DataLoader(
+            dataset,
+            batch_size=conf.batch_size,
+            shuffle=True,
+            generator=generator,
+        )
+        return quantize_model(classifier, calibration_dl)
+
+    def load_onnx(self, classifier, modelpath):
+        """
+        Load the onnx version of the model, exporting it first if it does not
+        exist yet or is older than the checkpoint. Falls back to the torch
+        model if onnxruntime is missing.
+        """
+        if importlib.util.find_spec("onnxruntime") is None:
+            logger.warning("onnxruntime is not installed, using torch model")
+            return classifier
+
+        onnxpath = pathlib.Path(conf.onnx_path)
+        modelpath = pathlib.Path(modelpath)
+        if (
+            not onnxpath.exists()
+            or modelpath.stat().st_mtime > onnxpath.stat().st_mtime
+        ):
+            logger.info(f"Exporting {modelpath} to onnx")
+            export_onnx(classifier, onnxpath, conf.img_size_px)
+        return OnnxModel(onnxpath, conf.detection_batch_size, conf.img_size_px)
+
     def detect(self):
-        # number of chunks needed to process the whole dataset
-        n_chunks = np.ceil(self.data.raw.shape[0] / self.chunksize).astype(int)
+        # load the chunks in a background worker while the previous chunk
+        # is processed on the device
+        chunks = ChunkDataset(self.data, self.chunksize, self.spectrogram_overlap)
+        n_chunks = len(chunks)
+        loader = DataLoader(
+            chunks,
+            batch_size=None,
+            num_workers=conf.num_workers,
+            prefetch_factor=2 if conf.num_workers > 0 else None,
+            worker_init_fn=reopen_worker_dataset,
+        )
 
         # TODO: Mask high amplitude vertical noise bands again
 
+        # one figure is reused for the plots of all chunks
+        if conf.plot_detections:
+            fig, ax = plt.subplots(
+                figsize=(60 * ps.cm, 20 * ps.cm),
+                constrained_layout=True,
+            )
+            im = None
+            chunk_artists = []
+
         chirps = []
-        for i in track(
-            range(n_chunks),
-            description=f"Detecting chirps for {self.data.path.name}",
+        for i, (idx1, idx2, chunk) in enumerate(
+            track(
+                loader,
+                total=n_chunks,
+                description=f"Detecting chirps for {self.data.path.name}",
+            )
         ):
             logger.info(f"Processing chunk {i + 1} of {n_chunks}...")
 
-            # get start and stop indices for the current chunk
-            # including some overlap to compensate for edge effects
-            # this diffrers for the first and last chunk
-
-            if i == 0:
-                idx1 = sint(i * self.chunksize)
-                idx2 = sint((i + 1) * self.chunksize + self.spectrogram_overlap)
-            elif i == n_chunks - 1:
-                idx1 = sint(i * self.chunksize - self.spectrogram_overlap)
-                idx2 = sint((i + 1) * self.chunksize)
-            else:
-                idx1 = sint(i * self.chunksize - self.spectrogram_overlap)
-                idx2 = sint((i + 1) * self.chunksize + self.spectrogram_overlap)
-
-            # check if start of the chunk is before the end of the data
-            first_chunk_time = idx1 / self.samplingrate
-            first_track_time = self.data.track_times[0]
-
             # compute the time of the spectrogram
             spec_times = np.arange(idx1, idx2 + 1, self.hop_len) / self.samplingrate
             spec_freqs = np.arange(0, self.nfft / 2 + 1) * self.samplingrate / self.nfft
 
-            # skip if the chunk is before the first track
-            if first_chunk_time < first_track_time:
-                continue
-
-            chunk = DataSubset(self.data, idx1, idx2)
-
-            # check if the chunk has data
-            if chunk.hasdata is False:
-                logger.info("No data in chunk, skipping...")
-                del chunk
+            # skip if the chunk is before the first track or has no data
+            if chunk is None:
                 continue
 
             # compute the spectrogram for all electrodes
             for el in range(self.n_electrodes):
                 # get the signal for the current electrode
-                sig = chunk.raw[:, el]
+                sig = self.stage_signal(chunk.raw[el])
 
                 # compute the spectrogram for the current electrode
                 chunk_spec, _, _ = spectrogram(
-                    sig.copy(),
+                    sig,
                     self.samplingrate,
                     nfft=self.nfft,
                     hop_length=self.hop_len,
@@ -509,8 +715,10 @@ class Detector:
             spec_freqs = spec_freqs[spec_freqs <= conf.upper_spectrum_limit]
 
             # normalize the spectrogram to zero mean and unit variance
+            # in place, mean and std are computed in a single pass
             # the spec is still a tensor
-            spec = (spec - spec.mean()) / spec.std()
+            std, mean = torch.std_mean(spec)
+            spec.sub_(mean).div_(std)
 
             # make a detection data dict
             # the spec is still a tensor!
@@ -534,63 +742,82 @@ class Detector:
             chirps.extend(chunk_chirps)
 
             # plot
-            plot = True
-            if (len(chunk_chirps) > 0) and plot:
-                fig, ax = plt.subplots(
-                    figsize=(60 * ps.cm, 20 * ps.cm),
-                    constrained_layout=True,
-                )
-                specshow(
-                    spec.cpu().numpy(),
-                    spec_times,
-                    spec_freqs,
-                    ax,
-                    aspect="auto",
-                    origin="lower",
-                )
+            if (len(chunk_chirps) > 0) and conf.plot_detections:
+                # the spectrogram image is drawn once and only its data is
+                # swapped for the following chunks
+                if im is None:
+                    im = specshow(
+                        spec.cpu().numpy(),
+                        spec_times,
+                        spec_freqs,
+                        ax,
+                        aspect="auto",
+                        origin="lower",
+                    )
+                else:
+                    im.set_data(spec.cpu().numpy())
+                    im.set_extent(
+                        [spec_times[0], spec_times[-1], spec_freqs[0], spec_freqs[-1]]
+                    )
+                    im.autoscale()
+
+                # remove the markers of the previous chunk
+                for artist in chunk_artists:
+                    artist.remove()
+                chunk_artists = []
+
                 if len(noise_index) > 0:
                     try:
-                        ax.fill_between(
-                            spec_times,
-                            np.zeros(spec_times.shape),
-                            noise_index * 2000,
-                            color=ps.black,
-                            alpha=0.6,
+                        chunk_artists.append(
+                            ax.fill_between(
+                                spec_times,
+                                np.zeros(spec_times.shape),
+                                noise_index * 2000,
+                                color=ps.black,
+                                alpha=0.6,
+                            )
                         )
                     except:
                         logger.warning(
                             f"Could not plot noise index. Shape of noise index: {noise_index.shape}. Shape of spec_times: {spec_times.shape}."
                         )
 
-                for chirp in chunk_chirps:
+                chirp_array = np.asarray(chunk_chirps)
+                chunk_artists.append(
                     ax.scatter(
-                        chirp[0],
-                        chirp[1],
+                        chirp_array[:, 0],
+                        chirp_array[:, 1],
                         facecolors="white",
                         edgecolors="black",
                         s=15,
                     )
-                    ax.text(
-                        chirp[0],
-                        chirp[1] + 50,
-                        np.round(chirp[2], 2),
-                        fontsize=10,
-                        color="white",
-                        rotation="vertical",
-                        va="bottom",
-                        ha="center",
+                )
+                for chirp in chunk_chirps:
+                    chunk_artists.append(
+                        ax.text(
+                            chirp[0],
+                            chirp[1] + 50,
+                            np.round(chirp[2], 2),
+                            fontsize=10,
+                            color="white",
+                            rotation="vertical",
+                            va="bottom",
+                            ha="center",
+                        )
                     )
+                # the data limits accumulate over the reused axes, so the
+                # view is pinned to the current chunk
+                ax.set_xlim(spec_times[0], spec_times[-1])
                 ax.set_ylim(300, 1200)
-                plt.savefig(f"{self.plotpath}/{str(self.data.path.name)}_{i}.png")
-                plt.cla()
-                plt.clf()
-                plt.close("all")
-                plt.close(fig)
+                fig.savefig(f"{self.plotpath}/{str(self.data.path.name)}_{i}.png")
 
             del detection_data
             del spec
             torch.cuda.empty_cache()
 
+        if conf.plot_detections:
+            plt.close(fig)
+
         # reformat the detected chirps
         chirps = np.array(chirps)
         if len(chirps) == 0:
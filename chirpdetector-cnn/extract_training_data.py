@@ -14,9 +14,8 @@ import uuid
 
 import numpy as np
 import torch
-from IPython import embed
 from models.modelhandling import check_device
-from utils.datahandling import find_on_time, resize_tensor_image
+from utils.datahandling import find_on_times, resize_tensor_image
 from utils.filehandling import ConfLoader, NumpyLoader
 from utils.logger import make_logger
 from utils.plotstyle import PlotStyle
@@ -42,11 +41,6 @@ class ChirpExtractor:
         self.window_size = int(conf.time_pad * 2 * self.fill_samplerate)
         self.stride = int(conf.stride * self.fill_samplerate)
 
-        if (self.data.times[-1] // 600 != 0) and (self.mode == "memory"):
-            logger.warning(
-                "It is recommended to process recordings longer than 10 minutes using the 'disk' mode"
-            )
-
         if self.window_size % 2 == 0:
             self.window_size += 1
             logger.info(f"Time padding is not odd. Adding one.")
@@ -64,20 +58,22 @@ class ChirpExtractor:
             first_index, last_index - self.window_size, self.stride, dtype=int
         )
 
-        # get spectrogram mean and std for normalization
-        # mu, std = self.data.fill_spec.mean(), self.data.fill_spec.std()
+        # cut off unused frequencies, the frequency axis is sorted so this
+        # is a view on the memory-mapped spectrogram
+        n_freqs = np.sum(self.data.fill_freqs <= conf.upper_spectrum_limit)
+        spec = self.data.fill_spec[:n_freqs, :]
+        self.data.fill_freqs = self.data.fill_freqs[:n_freqs]
 
-        # cut off unused frequencies
-        self.data.fill_spec = self.data.fill_spec[
-            self.data.fill_freqs <= conf.upper_spectrum_limit, :
-        ]
-        self.data.fill_freqs = self.data.fill_freqs[
-            self.data.fill_freqs <= conf.upper_spectrum_limit
-        ]
+        # get spectrogram mean and std for normalization
+        mu, std = self.spectrogram_stats(spec)
 
-        # normalize spectrogram
-        mu, std = self.data.fill_spec.mean(), self.data.fill_spec.std()
-        self.data.fill_spec = (self.data.fill_spec - mu) / std
+        # Get the center times of all windows, these are the same for
+        # all tracks
+        center_idxs = (
+            window_start_indices + np.floor(self.window_size / 2) + 1
+        ).astype(int)
+        center_t = self.data.fill_times[center_idxs]
+        noise_times = self.data.noise_times
 
         for track_id in np.unique(self.data.ident_v):
             logger.info(f"Processing track {track_id}...")
@@ -86,68 +82,57 @@ class ChirpExtractor:
             chirp_times = self.data.correct_chirp_times[
                 self.data.correct_chirp_time_ids == track_id
             ]
-            noise_times = self.data.noise_times
-            snippets = []
-            center_t = []
 
-            for window_start_index in window_start_indices:
-                # Make index were current window will end
-                window_end_index = window_start_index + self.window_size
+            # Find the windows that contain chirps and noise bands
+            chirp_times = np.asarray(sorted(chirp_times))
+            spec_chirp_idx = find_on_times(center_t, chirp_times, limit=False)
+            spec_noise_idx = find_on_times(center_t, noise_times, limit=False)
 
-                # Get the current frequency from the track
-                center_idx = int(
-                    window_start_index + np.floor(self.window_size / 2) + 1
+            # Choose random windows without chirps and noise
+            delete_idx = np.concatenate((spec_chirp_idx, spec_noise_idx))
+            remaining_idx = np.delete(np.arange(len(center_t)), delete_idx)
+            number_of_nochirps = (
+                len(spec_chirp_idx) * conf.training_dataset_bias
+            )
+            spec_nochirp_idx = remaining_idx[
+                np.random.choice(
+                    len(remaining_idx), number_of_nochirps, replace=False
                 )
-                window_center_t = self.data.fill_times[center_idx]
-                track_index = find_on_time(self.data.times, window_center_t)
-                center_freq = track[track_index]
-
-                # From the track frequency compute the frequency
-                # boundaries
-
-                freq_min = center_freq + self.freq_pad[0]
-                freq_max = center_freq + self.freq_pad[1]
-
-                # Find these values on the frequency axis of the spectrogram
-                freq_min_index = find_on_time(self.data.fill_freqs, freq_min)
-                freq_max_index = find_on_time(self.data.fill_freqs, freq_max)
-
-                # Using window start, stop and freq lims, extract snippet from spec
-                snippet = self.data.fill_spec[
-                    freq_min_index:freq_max_index,
-                    window_start_index:window_end_index,
-                ]
-
-                snippet = torch.from_numpy(snippet)
-
-                # Normalize snippet
-                # snippet = norm_tensor(snippet)
-                # snippet = (snippet - mu) / std
-
-                # Resize snippet
-                snippet = resize_tensor_image(snippet, conf.img_size_px)
-
-                # take only the image part
-                snippet = snippet[0][0]
+            ]
 
-                # to float32
-                snippet = snippet.type(torch.float32)
-                snippet = snippet.numpy()
+            # Only the windows that are saved are cut out of the spectrogram
+            window_idx = np.concatenate(
+                (spec_chirp_idx, spec_noise_idx, spec_nochirp_idx)
+            )
 
-                # Append snippet to list
-                snippets.append(snippet)
-                center_t.append(window_center_t)
+            # Get the current frequencies from the track
+            track_indices = find_on_times(
+                self.data.times, center_t[window_idx], False
+            )
+            center_freqs = track[track_indices]
 
-            center_t = np.asarray(center_t)
-            chirp_times = np.asarray(sorted(chirp_times))
-            spec_chirp_idx = np.asarray(
-                [find_on_time(center_t, t, limit=False) for t in chirp_times]
+            # From the track frequencies compute the frequency
+            # boundaries and find them on the frequency axis of the
+            # spectrogram
+            freq_min_indices = find_on_times(
+                self.data.fill_freqs, center_freqs + self.freq_pad[0], False
             )
-            spec_noise_idx = np.asarray(
-                [find_on_time(center_t, t, limit=False) for t in noise_times]
+            freq_max_indices = find_on_times(
+                self.data.fill_freqs, center_freqs + self.freq_pad[1], False
             )
 
-            snippets = np.asarray(snippets)
+            snippets = self.extract_windows(
+                spec,
+                mu,
+                std,
+                window_start_indices[window_idx],
+                freq_min_indices,
+                freq_max_indices,
+            )
+            chirp_snippets, noise_snippets, nochirp_snippets = np.split(
+                snippets,
+                np.cumsum((len(spec_chirp_idx), len(spec_noise_idx))),
+            )
 
             # setup path to save snippets
             chirppath = pathlib.Path(f"{conf.training_data_path}/chirp")
@@ -156,31 +141,91 @@ class ChirpExtractor:
             nochirppath.mkdir(parents=True, exist_ok=True)
 
             # save chirps
-            for snip in snippets[spec_chirp_idx]:
+            for snip in chirp_snippets:
                 np.save(chirppath / str(uuid.uuid1()), snip)
             logger.info(f"Saved {len(spec_chirp_idx)} chirps")
 
             # save noise bands
-            for snip in snippets[spec_noise_idx]:
+            for snip in noise_snippets:
                 np.save(nochirppath / str(uuid.uuid1()), snip)
             logger.info(f"Saved {len(spec_noise_idx)} vertical noise bands")
 
-            # Remove the chirps and noise from the snippets
-            delete_idx = np.concatenate((spec_chirp_idx, spec_noise_idx))
-            snippets = np.delete(snippets, delete_idx, axis=0)
-
             # save random snippets as no chirps
-            number_of_nochirps = (
-                len(spec_chirp_idx) * conf.training_dataset_bias
-            )
-            for snip in snippets[
-                np.random.choice(
-                    len(snippets), number_of_nochirps, replace=False
-                )
-            ]:
+            for snip in nochirp_snippets:
                 np.save(nochirppath / str(uuid.uuid1()), snip)
             logger.info(f"Saved {number_of_nochirps} non chirps")
 
+    def spectrogram_stats(self, spec):
+        """
+        Compute mean and standard deviation of the spectrogram in tiles along
+        the time axis, so that a memory-mapped spectrogram is never loaded
+        into memory as a whole.
+        """
+        tile = int(conf.buffersize * self.fill_samplerate)
+        tile_starts = range(0, spec.shape[1], tile)
+
+        total = 0.0
+        for start in tile_starts:
+            total += np.sum(spec[:, start : start + tile], dtype=np.float64)
+        mu = total / spec.size
+
+        squares = 0.0
+        for start in tile_starts:
+            squares += np.sum(
+                (spec[:, start : start + tile] - mu) ** 2, dtype=np.float64
+            )
+        std = np.sqrt(squares / spec.size)
+
+        return mu, std
+
+    def extract_windows(
+        self, spec, mu, std, start_indices, freq_min_indices, freq_max_indices
+    ):
+        """
+        Cut out windows from the memory-mapped spectrogram, normalize and
+        resize them. Only the windows themselves are read from disk.
+        """
+        snippets = np.empty(
+            (len(start_indices), conf.img_size_px, conf.img_size_px),
+            dtype=np.float32,
+        )
+
+        # The frequency boundaries are rounded to the frequency axis, so
+        # the height of the windows can differ by a bin. Windows of the
+        # same height are cut out and resized together in batches.
+        heights = freq_max_indices - freq_min_indices
+        for height in np.unique(heights):
+            group = np.flatnonzero(heights == height)
+            for i in range(0, len(group), conf.batch_size):
+                batch = group[i : i + conf.batch_size]
+
+                # Using window starts, stops and freq lims, extract
+                # snippets from spec
+                freq_ranges = freq_min_indices[batch, np.newaxis] + np.arange(
+                    height
+                )
+                time_ranges = start_indices[batch, np.newaxis] + np.arange(
+                    self.window_size
+                )
+                batch_snippets = spec[
+                    freq_ranges[:, :, np.newaxis], time_ranges[:, np.newaxis, :]
+                ]
+
+                # Normalize snippets with the statistics of the whole
+                # spectrogram
+                batch_snippets = (batch_snippets - mu) / std
+                batch_snippets = torch.from_numpy(batch_snippets[:, np.newaxis])
+
+                # Resize snippets
+                batch_snippets = resize_tensor_image(
+                    batch_snippets, conf.img_size_px
+                )
+
+                # take only the image part and convert to float32
+                snippets[batch] = batch_snippets[:, 0].type(torch.float32).numpy()
+
+        return snippets
+
 
 def main():
     d = NumpyLoader(conf.testing_data_path)
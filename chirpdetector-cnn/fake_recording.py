@@ -16,7 +16,7 @@ import numpy as np
 from IPython import embed
 from models.modelhandling import check_device
 from simulations.fish_signal import chirps, rises, wavefish_eods
-from utils.datahandling import find_on_time
+from utils.datahandling import find_on_times
 from utils.filehandling import ConfLoader, NumpyLoader
 from utils.logger import make_logger
 from utils.plotstyle import PlotStyle
@@ -391,9 +391,7 @@ def main():
             d.correct_chirp_time_ids == track_id
         ]
         time_index = np.searchsorted(track_times, id_chirp_times)
-        freq_index = [
-            find_on_time(track_times, chirp, False) for chirp in id_chirp_times
-        ]
+        freq_index = find_on_times(track_times, id_chirp_times, False)
         ax.scatter(
             track_times[time_index],
             track[freq_index],
@@ -1,7 +1,10 @@
+import copy
 import os
 
 import numpy as np
 import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
 from torch.utils.data import Dataset
 from utils.logger import make_logger
 
@@ -29,6 +32,115 @@ def load_model(modelpath, model):
     return mod
 
 
+def quantize_model(model, calibration_dl, n_batches=10):
+    """
+    Statically quantize a model to int8 for inference on the cpu. The
+    activation ranges are calibrated on a few batches of representative
+    images from the calibration dataloader.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    example_inputs = (next(iter(calibration_dl))[0],)
+    prepared = prepare_fx(
+        model, get_default_qconfig_mapping("x86"), example_inputs
+    )
+    with torch.no_grad():
+        for i, (images, _) in enumerate(calibration_dl):
+            if i == n_batches:
+                break
+            prepared(images)
+    logger.info("Quantized model to int8")
+    return convert_fx(prepared)
+
+
+def export_onnx(model, onnxpath, img_size):
+    """
+    Export a trained model to ONNX with a dynamic batch dimension.
+    """
+    param = next(model.parameters())
+    dummy = torch.rand(
+        1, 1, img_size, img_size, device=param.device, dtype=param.dtype
+    )
+    torch.onnx.export(
+        model,
+        dummy,
+        str(onnxpath),
+        input_names=["input"],
+        output_names=["output"],
+        opset_version=17,
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+    )
+    logger.info(f"Exported model to {onnxpath}")
+
+
+class OnnxModel:
+    """
+    Wrap an onnxruntime inference session so that it can be called like the
+    torch model. TensorRT and CUDA execution providers are used if they are
+    available, otherwise the session runs on the cpu. The TensorRT engine is
+    built for a single fixed input shape of batch_size images, so the
+    batches passed to the model must be padded to that size if
+    uses_tensorrt is set.
+    """
+
+    def __init__(self, onnxpath, batch_size, img_size):
+        import onnxruntime as ort
+
+        shape = f"input:{batch_size}x1x{img_size}x{img_size}"
+        trt_options = {
+            "trt_profile_min_shapes": shape,
+            "trt_profile_opt_shapes": shape,
+            "trt_profile_max_shapes": shape,
+        }
+        preferred = [
+            ("TensorrtExecutionProvider", trt_options),
+            ("CUDAExecutionProvider", {}),
+            ("CPUExecutionProvider", {}),
+        ]
+        available = ort.get_available_providers()
+        providers = [p for p in preferred if p[0] in available]
+        self.session = ort.InferenceSession(str(onnxpath), providers=providers)
+        self.on_device = self.session.get_providers()[0] != "CPUExecutionProvider"
+        self.uses_tensorrt = (
+            self.session.get_providers()[0] == "TensorrtExecutionProvider"
+        )
+        self.n_classes = self.session.get_outputs()[0].shape[1]
+        logger.info(
+            f"Loaded onnx model {onnxpath} using {self.session.get_providers()}"
+        )
+
+    def __call__(self, x):
+        if x.is_cuda and self.on_device:
+            return self.run_on_device(x)
+        outputs = self.session.run(None, {"input": x.cpu().numpy()})[0]
+        return torch.from_numpy(outputs)
+
+    def run_on_device(self, x):
+        """
+        Bind the input and output tensors directly to the session so that
+        the batch does not take a round trip through host memory.
+        """
+        x = x.to(torch.float32).contiguous()
+        out = torch.empty(
+            (x.shape[0], self.n_classes), dtype=torch.float32, device=x.device
+        )
+        device_id = x.device.index or 0
+        binding = self.session.io_binding()
+        binding.bind_input(
+            "input", "cuda", device_id, np.float32, tuple(x.shape), x.data_ptr()
+        )
+        binding.bind_output(
+            "output", "cuda", device_id, np.float32, tuple(out.shape), out.data_ptr()
+        )
+        # the session runs on its own stream, make sure the input is written
+        torch.cuda.current_stream(x.device).synchronize()
+        self.session.run_with_iobinding(binding)
+        return out
+
+    def parameters(self):
+        # the session holds no torch parameters
+        return iter(())
+
+
 def train_epoch(model, train_dl, optimizer, criterion, scheduler):
     train_loss, correct_prediction = 0.0, 0.0
     model.train()
@@ -1,7 +1,6 @@
 import numpy as np
 import torch
 import torch.nn.functional as F
-from IPython import embed
 
 from .logger import make_logger
 
@@ -35,14 +34,39 @@ def resize_tensor_image(image, length):
         image = image.unsqueeze(0)
 
     # Perform resizing using torch.nn.functional.interpolate
-    try:
-        resized_image = F.interpolate(image, size=(length, length), mode="area")
-    except:
-        embed()
+    resized_image = F.interpolate(image, size=(length, length), mode="area")
 
     return resized_image
 
 
+def extract_snippets(spec, freq_ranges, time_ranges):
+    """
+    Cut out many windows from a spectrogram tensor at once.
+
+    Parameters
+    ----------
+    spec : torch.Tensor, required
+        The spectrogram of shape (frequencies, times).
+    freq_ranges : np.ndarray, required
+        Frequency indices of each window, shape (windows, frequencies).
+    time_ranges : np.ndarray, required
+        Time indices of each window, shape (windows, times).
+
+    Returns
+    -------
+    snippets : torch.Tensor
+        The windows of shape (windows, 1, frequencies, times).
+    """
+    freq_ranges = torch.as_tensor(freq_ranges, device=spec.device)
+    time_ranges = torch.as_tensor(time_ranges, device=spec.device)
+
+    # broadcast the index arrays against each other to gather all windows
+    snippets = spec[freq_ranges[:, :, None], time_ranges[:, None, :]]
+
+    # add a channel dimension
+    return snippets[:, None, :, :]
+
+
 # def resize_image(image, length):
 #     image = cv2.resize(image, (length, length), interpolation=cv2.INTER_AREA)
 #     return image
@@ -134,6 +158,66 @@ def find_on_time(array, target, limit=True):
     return idx
 
 
+def find_on_times(array, targets, limit=True):
+    """Vectorized version of find_on_time. Takes a sorted time array and
+    many targets and returns the indices of the closest values on the array
+    for all targets in a single pass.
+
+    Parameters
+    ----------
+    array : array, required
+        The array to search in, must be sorted.
+    targets : array, required
+        The numbers that need to be found in the array.
+    limit : bool, default True
+        To limit or not to limit the difference between targets and array
+        values.
+
+    Returns
+    ----------
+    idx : array,
+        Indices for the array where the closest values to the targets are.
+        If limit is True, targets that are further than half a sampling
+        interval away from the array are NaN.
+    """
+    array = np.asarray(array)
+    targets = np.asarray(targets)
+
+    # find the closest values
+    idx = array.searchsorted(targets)
+    idx = np.clip(idx, 1, len(array) - 1)
+    left = array[idx - 1]
+    right = array[idx]
+    idx -= targets - left < right - targets
+    found = array[idx]
+
+    # compute the sampling interval at each found index, the interval to the
+    # next value is used before the array and when the target is above
+    # the found value, the interval to the previous value otherwise
+    next_dt = array[np.minimum(idx + 1, len(array) - 1)] - found
+    prev_dt = found - array[np.maximum(idx - 1, 0)]
+    use_next = (targets <= array[0]) | (
+        (targets < array[-1]) & (targets - found >= 0)
+    )
+    dt_sampled = np.where(use_next, next_dt, prev_dt)
+
+    outside = np.abs(found - targets) > dt_sampled / 2
+    if not np.any(outside):
+        return idx
+
+    if limit:
+        idx = idx.astype(float)
+        idx[outside] = np.nan
+        logger.error(
+            f"{np.sum(outside)} targets are outside of array limits."
+        )
+    else:
+        logger.warning(
+            f"{np.sum(outside)} targets are outside of array limits but you allowed this!"
+        )
+    return idx
+
+
 def merge_duplicates(timestamps, threshold):
     """
     Compute the mean of groups of timestamps that are closer to the previous
@@ -222,47 +306,31 @@ def cluster_peaks(arr, thresh=0.5):
     np.array(np.array(int))
         Each subarray contains the indices of the values belonging to a peak.
     """
-    clusters = []
-    cluster = []
-    for i, val in enumerate(arr):
-        # do nothing or append prev cluste if val is below threshold
-        # then clear the current cluster
-        if val <= thresh:
-            if len(cluster) > 0:
-                clusters.append(cluster)
-                cluster = []
-            continue
-
-        # if larger than thresh
-        # if first value in array, append to cluster
-        # since there is no previous value to compare to
-        if i == 0:
-            cluster.append(i)
-
-        # if this is the last value then there is no future value
-        # to compare to so append to cluster
-        elif i == len(arr) - 1:
-            cluster.append(i)
-            clusters.append(cluster)
-
-        # if were at a trough then the diff between the current value and
-        # the previous value will be negative and the diff between the
-        # future value and the current value will be positive
-        elif val - arr[i - 1] < 0 and arr[i + 1] - val > 0:
-            cluster.append(i)
-            clusters.append(cluster)
-            cluster = []
-            cluster.append(i)
-
-        # if this is not the first value or the last value or a trough
-        # then append to cluster
-        else:
-            cluster.append(i)
+    arr = np.asarray(arr)
+
+    # find the runs of values above the threshold, stops are exclusive
+    above = np.concatenate(([False], arr > thresh, [False]))
+    edges = np.diff(above.astype(int))
+    run_starts = np.flatnonzero(edges == 1)
+    run_stops = np.flatnonzero(edges == -1)
 
-    return clusters
+    # troughs split a run into two clusters and belong to both of them.
+    # A trough is lower than both neighbours, so it is always inside a run
+    troughs = np.zeros(len(arr), dtype=bool)
+    troughs[1:-1] = (arr[1:-1] < arr[:-2]) & (arr[2:] > arr[1:-1])
+    troughs = np.flatnonzero(troughs & (arr > thresh))
+
+    # each trough ends the current cluster and starts the next one
+    starts = np.sort(np.concatenate((run_starts, troughs)))
+    stops = np.sort(np.concatenate((run_stops, troughs + 1)))
+
+    return [np.arange(start, stop) for start, stop in zip(starts, stops)]
 
 
 def norm_tensor(tensor):
-    return (tensor - torch.min(tensor)) / (
-        torch.max(tensor) - torch.min(tensor)
-    )
+    """
+    Min-max normalize a tensor to the range between 0 and 1. Minimum and
+    maximum are computed in a single pass, constant tensors map to 0.
+    """
+    mn, mx = torch.aminmax(tensor)
+    return (tensor - mn) / (mx - mn + 1e-8)
@@ -22,8 +22,15 @@ class ConfLoader:
 
 
 class NumpyLoader:
-    def __init__(self, dir_path):
+    """
+    Load all numpy files in a directory as class attributes. By default the
+    arrays are memory-mapped, so only the parts that are accessed are read
+    from disk.
+    """
+
+    def __init__(self, dir_path, mmap_mode="r"):
         self.dir_path = dir_path
+        self.mmap_mode = mmap_mode
         self.load_numpy_files()
 
     def load_numpy_files(self):
@@ -32,7 +39,9 @@ class NumpyLoader:
 
         for npy_file in npy_files:
             attr_name = os.path.splitext(npy_file)[0]
-            attr_value = np.load(os.path.join(self.dir_path, npy_file))
+            attr_value = np.load(
+                os.path.join(self.dir_path, npy_file), mmap_mode=self.mmap_mode
+            )
             setattr(self, attr_name, attr_value)
 
     def __repr__(self) -> str:
@@ -110,14 +119,14 @@ class DataSubset:
         for track_id in np.unique(
             data.track_idents[~np.isnan(data.track_idents)]
         ):
-            track = data.track_freqs[data.track_idents == track_id]
-            time = data.track_times[
-                data.track_indices[data.track_idents == track_id]
-            ]
-            index = data.track_indices[data.track_idents == track_id]
-
-            track = track[(time >= start_t) & (time <= stop_t)]
-            index = index[(time >= start_t) & (time <= stop_t)]
+            track_mask = data.track_idents == track_id
+            track = data.track_freqs[track_mask]
+            index = data.track_indices[track_mask]
+            time = data.track_times[index]
+
+            time_mask = (time >= start_t) & (time <= stop_t)
+            track = track[time_mask]
+            index = index[time_mask]
             ident = np.repeat(track_id, len(track))
 
             tracks.append(track)
@@ -149,24 +158,40 @@ class NumpyDataset:
 
         # load raw file for simulated and real data
         file = os.path.join(datapath / "traces-grid1.raw")
+        self.rawfile = file
+        self.reopen()
         if os.path.exists(file):
-            self.raw = DataLoader(file, 60.0, 0, channel=-1)
             self.samplerate = self.raw.samplerate
-            self.n_electrodes = self.raw.shape[1]
         else:
-            self.raw = np.load(datapath / "raw.npy", allow_pickle=True)
             self.samplerate = 20000.0
-            if len(np.shape(self.raw)) > 1:
-                self.n_electrodes = self.raw.shape[1]
-            else:
-                self.n_electrodes = 1
-                self.raw = self.raw[:, np.newaxis]
+        self.n_electrodes = self.raw.shape[1]
 
         self.track_times = np.load(datapath / "times.npy", allow_pickle=True)
         self.track_freqs = np.load(datapath / "fund_v.npy", allow_pickle=True)
         self.track_indices = np.load(datapath / "idx_v.npy", allow_pickle=True)
         self.track_idents = np.load(datapath / "ident_v.npy", allow_pickle=True)
 
+    def reopen(self) -> None:
+        """
+        Open the raw recording, numpy files are memory-mapped. Loader workers
+        receive the dataset without the raw recording and call this to open
+        their own handle on it.
+        """
+        if os.path.exists(self.rawfile):
+            self.raw = DataLoader(self.rawfile, 60.0, 0, channel=-1)
+        else:
+            raw = np.load(self.path / "raw.npy", allow_pickle=True, mmap_mode="r")
+            if raw.ndim == 1:
+                raw = raw[:, np.newaxis]
+            self.raw = raw
+
+    def __getstate__(self) -> dict:
+        # do not pickle the raw recording, the thunderfish loader holds an
+        # open file and a memmap would be pickled as a full in-memory copy
+        state = self.__dict__.copy()
+        state["raw"] = None
+        return state
+
     def __repr__(self) -> str:
         return f"NumpyDataset({self.file})"
 
@@ -1,13 +1,10 @@
 import math
+from functools import lru_cache
 
 import numpy as np
 import torch
-from IPython import embed
-from models.modelhandling import check_device
 from torchaudio.transforms import AmplitudeToDB, Spectrogram
 
-device = check_device()
-
 
 def next_power_of_two(num):
     """Computes the next power of two for a given number.
@@ -119,12 +116,32 @@ def specshow(spec, time, freq, ax, **kwargs):
     return im
 
 
+@lru_cache(maxsize=None)
+def _spectrogram_transform(nfft, hop_length, device):
+    """Build the spectrogram transform once per parameter set and device,
+    so that the window is not recreated for every electrode and chunk.
+    """
+    return Spectrogram(
+        n_fft=nfft,
+        hop_length=hop_length,
+        power=2,
+        normalized=True,
+        window_fn=torch.hann_window,
+    ).to(device)
+
+
+@lru_cache(maxsize=None)
+def _decibel_transform(device):
+    """Build the decibel transform once per device."""
+    return AmplitudeToDB(stype="power", top_db=60).to(device)
+
+
 def spectrogram(data, samplingrate, nfft, hop_length, trycuda=True):
     """Compute the spectrogram of a signal.
 
     Parameters
     ----------
-    data : np.ndarray
+    data : np.ndarray or torch.Tensor
         The 1D signal.
     samplingrate : float
         The sampling rate of the signal.
@@ -143,14 +160,10 @@ def spectrogram(data, samplingrate, nfft, hop_length, trycuda=True):
     else:
         device = torch.device("cpu")
 
-    data = torch.from_numpy(data).to(device)
-    spectrogram_of = Spectrogram(
-        n_fft=nfft,
-        hop_length=hop_length,
-        power=2,
-        normalized=True,
-        window_fn=torch.hann_window,
-    ).to(device)
+    if isinstance(data, np.ndarray):
+        data = torch.from_numpy(data)
+    data = data.to(device)
+    spectrogram_of = _spectrogram_transform(nfft, hop_length, device)
     spec = spectrogram_of(data)
     time = np.arange(0, spec.shape[1]) * hop_length / samplingrate
     freq = np.arange(0, spec.shape[0]) * samplingrate / nfft
@@ -175,5 +188,5 @@ def decibel(spec, trycuda=True):
     else:
         device = torch.device("cpu")
 
-    decibel_of = AmplitudeToDB(stype="power", top_db=60).to(device)
+    decibel_of = _decibel_transform(device)
     return decibel_of(spec)